@@ -1,18 +1,24 @@
 # utf-8
+import heapq
 import logging
 import sys
 from datetime import datetime
-from typing import Iterator, NamedTuple, Optional, Set
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
 from PySide2 import QtCore as qtc, QtGui as qtg, QtWidgets as qtw
 
+try:
+    from numba import njit
+except ImportError:  # Path finding then simply runs as pure Python.
+    def njit(*args, **kwargs):
+        return lambda function: function
+
 # Sizes
 CELL_SIZE = 50
 WALL_SIZE = 20
 GRID_SIZE = CELL_SIZE * 9 + WALL_SIZE * 8  # == 610
 PLAYER_SIZE = 35
-SizePolicyFixed = qtw.QSizePolicy(*(qtw.QSizePolicy.Fixed,) * 2)
-SizePolicyExpanding = qtw.QSizePolicy(*(qtw.QSizePolicy.Expanding,) * 2)
 
 # Colors: 'color name', 0x00ff00 or qtg.QColor(r, g, b, a)
 # Commented colors are some colors I tried, I still search a better looking.
@@ -21,9 +27,22 @@ VOID_COLOR = WALL_COLOR = 'cyan'  # 0xffa54f
 PLAYER_COLORS = 'green', 'red'
 
 # Fonts
-MESSAGE_FONT = qtg.QFont('Times', 13)
-PLAYER_FONT = qtg.QFont('Times', 15)
-TURN_FONT = qtg.QFont('Times', 20, qtg.QFont.Bold)
+FONTS = {
+    'message': ('Times', 13),
+    'player': ('Times', 15),
+    'turn': ('Times', 20, qtg.QFont.Bold),
+}
+
+
+# Qt objects below are only built when first used, once QApplication exists.
+@lru_cache(maxsize=None)
+def _font(key: str) -> qtg.QFont:
+    return qtg.QFont(*FONTS[key])
+
+
+@lru_cache(maxsize=None)
+def _size_policy(policy: qtw.QSizePolicy.Policy) -> qtw.QSizePolicy:
+    return qtw.QSizePolicy(policy, policy)
 
 
 class Position(NamedTuple):
@@ -33,67 +52,115 @@ class Position(NamedTuple):
     def in_grid(self) -> bool:
         return 0 <= self.row < 9 and 0 <= self.col < 9
 
-    def __add__(self, other):
-        assert isinstance(other, Position)
+    def __add__(self, other: 'Position') -> 'Position':
         return Position(self.row + other.row, self.col + other.col)
 
-    def __sub__(self, other):
-        assert isinstance(other, Position)
+    def __sub__(self, other: 'Position') -> 'Position':
         return Position(self.row - other.row, self.col - other.col)
 
-    def __mul__(self, n):
-        assert isinstance(n, int)
+    def __mul__(self, n: int) -> 'Position':
         return Position(self.row * n, self.col * n)
 
-    def __floordiv__(self, n):
-        assert isinstance(n, int)
+    def __floordiv__(self, n: int) -> 'Position':
         return Position(self.row // n, self.col // n)
 
     def manhattan(self, other: 'Position') -> int:
-        return sum(map(abs, self - other))
+        return abs(self.row - other.row) + abs(self.col - other.col)
 
 
 # Moves: North, South, West, East
 MOVES = Position(-1, 0), Position(1, 0), Position(0, -1), Position(0, 1)
 PLAYER_STARTS = Position(8, 4), Position(0, 4)
-PLAYER_HAS_WIN = (
-    lambda pos: pos.row == 0,
-    lambda pos: pos.row == 8,
+PLAYER_GOAL_ROWS = 0, 8
+
+
+# Path finding works on cell ids (0 to 80) rather than on positions.
+def _cell_id(row: int, col: int) -> int:
+    return row * 9 + col
+
+
+# Open directions of each cell are bits, in the same order as MOVES.
+NEIGHBOR_OFFSETS = -9, 9, -1, 1
+NORTH, SOUTH, WEST, EAST = (1 << direction for direction in range(4))
+GRID_ADJACENCY = bytes(
+    sum(
+        1 << direction
+        for direction, move in enumerate(MOVES)
+        if (Position(*divmod(cell, 9)) + move).in_grid()
+    )
+    for cell in range(81)
 )
 
 
+def _close_wall(adjacency: bytearray, cell: int, hv: str):
+    # A wall separates two pairs of cells, its middle part none.
+    if hv == 'h':
+        across, along, forward, backward = 9, 1, SOUTH, NORTH
+    else:
+        across, along, forward, backward = 1, 9, EAST, WEST
+    for n in range(2):
+        adjacency[cell + n * along] &= ~forward
+        adjacency[cell + n * along + across] &= ~backward
+
+
+@njit(cache=True)
+def _open_neighbors(cell: int, adjacency: bytearray) -> List[int]:
+    directions = adjacency[cell]
+    neighbors = []
+    for direction in range(4):
+        if directions >> direction & 1:
+            neighbors.append(cell + NEIGHBOR_OFFSETS[direction])
+    return neighbors
+
+
+@njit(cache=True)
+def _can_exit(start: int, goal_row: int, adjacency: bytearray) -> bool:
+    # A* search from start cell to the goal row, the row distance being an
+    # admissible heuristic, so that the search mostly walks straight to it.
+    visited = [False] * 81
+    heap = [(abs(start // 9 - goal_row), 0, start)]
+    while heap:
+        _, steps, cell = heapq.heappop(heap)
+        if not visited[cell]:
+            visited[cell] = True
+            for neighbor in _open_neighbors(cell, adjacency):
+                if neighbor // 9 == goal_row:
+                    return True
+                if not visited[neighbor]:
+                    cost = steps + 1 + abs(neighbor // 9 - goal_row)
+                    heapq.heappush(heap, (cost, steps + 1, neighbor))
+    return False
+
+
+def make_palette(role: qtg.QPalette.ColorRole, color: str) -> qtg.QPalette:
+    # Only this role is set, others are resolved from the parent widget.
+    palette = qtg.QPalette()
+    palette.setColor(role, qtg.QColor(color))
+    return palette
+
+
 class ClickableBoardWidget(qtw.QPushButton):
-    def __init__(self, board: 'Board', color: str):
+    def __init__(self, board: 'Board', palette: qtg.QPalette):
         super().__init__(board)
         self.setFlat(True)
         # Color
         self.setAutoFillBackground(True)
-        self.changeColor(color)
+        self.setPalette(palette)
         # Transfer click to the parent board.
         self.clicked.connect(lambda: board.receiveClick(self))
 
-    def changeColor(self, color: str):
-        palette = self.palette()
-        palette.setColor(qtg.QPalette.Button, qtg.QColor(color))
-        self.setPalette(palette)
-
 
 class UnclickableBoardWidget(qtw.QWidget):
-    def __init__(self, board: 'Board', color: str):
+    def __init__(self, board: 'Board', palette: qtg.QPalette):
         super().__init__(board)
         self.setAutoFillBackground(True)
-        self.changeColor(color)
-
-    def changeColor(self, color: str):
-        palette = self.palette()
-        palette.setColor(qtg.QPalette.Window, qtg.QColor(color))
         self.setPalette(palette)
 
 
 class Cell(ClickableBoardWidget):
     def __init__(self, board: 'Board'):
-        super().__init__(board, CELL_COLOR)
-        self.setSizePolicy(SizePolicyFixed)
+        super().__init__(board, board.cellPalette)
+        self.setSizePolicy(_size_policy(qtw.QSizePolicy.Fixed))
 
     def sizeHint(self):
         return qtc.QSize(CELL_SIZE, CELL_SIZE)
@@ -101,28 +168,28 @@ class Cell(ClickableBoardWidget):
 
 class Wall(ClickableBoardWidget):
     def __init__(self, board: 'Board'):
-        super().__init__(board, WALL_COLOR)
+        super().__init__(board, board.wallPalette)
         self.setMinimumSize(WALL_SIZE, WALL_SIZE)
-        self.setSizePolicy(SizePolicyExpanding)
+        self.setSizePolicy(_size_policy(qtw.QSizePolicy.Expanding))
 
     def filledBy(self, playerIndex: int):
-        self.changeColor(PLAYER_COLORS[playerIndex])
+        self.setPalette(self.parent().playerWallPalettes[playerIndex])
 
 
 class Void(UnclickableBoardWidget):
     def __init__(self, board: 'Board'):
-        super().__init__(board, VOID_COLOR)
+        super().__init__(board, board.voidPalette)
         self.setMinimumSize(WALL_SIZE, WALL_SIZE)
-        self.setSizePolicy(SizePolicyExpanding)
+        self.setSizePolicy(_size_policy(qtw.QSizePolicy.Expanding))
 
     def filledBy(self, playerIndex: int):
-        self.changeColor(PLAYER_COLORS[playerIndex])
+        self.setPalette(self.parent().playerVoidPalettes[playerIndex])
 
 
 class PlayerWidget(UnclickableBoardWidget):
     def __init__(self, board: 'Board', color: str):
-        super().__init__(board, color)
-        self.setSizePolicy(SizePolicyFixed)
+        super().__init__(board, make_palette(qtg.QPalette.Window, color))
+        self.setSizePolicy(_size_policy(qtw.QSizePolicy.Fixed))
 
     def sizeHint(self):
         return qtc.QSize(PLAYER_SIZE, PLAYER_SIZE)
@@ -141,7 +208,13 @@ class Game:
     def __init__(self):
         self.nb_players = 2
         self.players_positions = list(PLAYER_STARTS)
-        self.wall_parts: Set[Position] = set()
+        # Walls in two bitboards (horizontal and vertical walls), the wall
+        # centered below/right of (row, col) cell being the bit row * 8 + col.
+        self.h_walls = self.v_walls = 0
+        # Same walls, as open directions from each cell.
+        self.adjacency = bytearray(GRID_ADJACENCY)
+        # Path finding results: (index, h_walls, v_walls, start cell) -> bool
+        self.exits_cache: Dict[Tuple[int, int, int, int], bool] = {}
         self.index = 0
         self.count_walls = [20 // self.nb_players] * self.nb_players
 
@@ -150,61 +223,56 @@ class Game:
             index = self.index
         if position is None:
             position = self.players_positions[index]
-        return PLAYER_HAS_WIN[index](position)
+        return position.row == PLAYER_GOAL_ROWS[index]
 
     def next_turn(self):
         if not self.has_win():
             self.index = (self.index + 1) % self.nb_players
 
-    def naive_neighbors(
-        self, position: Position = None, wall_parts: Set[Position] = None,
-    ) -> Iterator[Position]:
+    def naive_neighbors(self, position: Position = None) -> Iterator[Position]:
         if position is None:
             position = self.players_positions[self.index]
-        if wall_parts is None:
-            wall_parts = self.wall_parts
-        for move in MOVES:
-            neighbor = position + move
-            if neighbor.in_grid() and position + neighbor not in wall_parts:
-                # In the grid and no wall blocks the way.
-                yield neighbor
-
-    def can_exit(self, index: int, wall_parts: Set[Position]) -> bool:
-        player_position = self.players_positions[index]
-        # Simple DFS from player position to available exits.
-        stack, visited = [player_position], set()
-        while stack:
-            position = stack.pop()
-            if position not in visited:
-                visited.add(position)
-                for neighbor in self.naive_neighbors(position, wall_parts):
-                    if self.has_win(index, neighbor):
-                        return True
-                    if neighbor not in visited:
-                        stack.append(neighbor)
-        return False
+        for neighbor in _open_neighbors(_cell_id(*position), self.adjacency):
+            yield Position(*divmod(neighbor, 9))
+
+    def can_exit(
+        self, index: int, h_walls: int, v_walls: int, adjacency: bytearray,
+    ) -> bool:
+        # Rejected walls are often tried again, and each attempt checks
+        # every player: the walls and the player cell are enough as a key.
+        start = _cell_id(*self.players_positions[index])
+        key = index, h_walls, v_walls, start
+        if key not in self.exits_cache:
+            self.exits_cache[key] = _can_exit(
+                start, PLAYER_GOAL_ROWS[index], adjacency,
+            )
+        return self.exits_cache[key]
 
     def add_wall(self, position: Position, hv: str) -> Optional[str]:
-        assert position.in_grid() and hv in ('h', 'v')
+        assert max(position) < 8 and position.in_grid() and hv in ('h', 'v')
         if not self.count_walls[self.index]:
             return self.ERROR_NO_WALL
+        logging.info(f'New wall at {position}, {hv}')
+        bit = 1 << (position.row * 8 + position.col)
         x = -1 if hv == 'v' else 1
-        move, other_move = (Position(0, 1), Position(1, 0))[::x]
-        wall_parts = {position * 2 + other_move + move * n for n in range(3)}
-        logging.info(
-            f'New wall parts at {position}, {hv}: '
-            + ', '.join(map(str, sorted(wall_parts)))
-        )
-        if wall_parts & self.wall_parts:
+        walls, other_walls = (self.h_walls, self.v_walls)[::x]
+        along, step = (position.col, 1) if hv == 'h' else (position.row, 8)
+        # A wall can not overlap a parallel wall, nor cross another one.
+        parallel = bit | bit >> step * (along > 0) | bit << step * (along < 7)
+        if walls & parallel or other_walls & bit:
             return self.ERROR_WALL_INTERSECTION
-        wall_parts |= self.wall_parts
+        h_walls = self.h_walls | bit * (hv == 'h')
+        v_walls = self.v_walls | bit * (hv == 'v')
+        adjacency = self.adjacency.copy()
+        _close_wall(adjacency, _cell_id(*position), hv)
         for index in range(self.nb_players):
-            if not self.can_exit(index, wall_parts):
+            if not self.can_exit(index, h_walls, v_walls, adjacency):
                 if index == self.index:
                     return self.ERROR_BLOCK_YOU
                 return self.ERROR_BLOCK_HIM
-        # Wall parts accepted, update data.
-        self.wall_parts |= wall_parts
+        # Wall accepted, update data.
+        self.h_walls, self.v_walls = h_walls, v_walls
+        self.adjacency = adjacency
         self.count_walls[self.index] -= 1
         self.next_turn()
 
@@ -225,12 +293,13 @@ class Game:
             diff = destination - current_position
             assert diff in {(-2, 0), (0, -2), (0, 2), (2, 0),
                             (-1, -1), (-1, 1), (1, -1), (1, 1)}
+            close = frozenset(self.naive_neighbors())
             if 0 in diff:
                 msg = self.ERROR_JUMP % 'over'
                 enemy = current_position + diff // 2
                 if enemy not in self.players_positions:
                     return self.ERROR_FAR_AWAY
-                if enemy not in self.naive_neighbors():
+                if enemy not in close:
                     return msg % 'no wall\nbetween you and him/her'
                 if destination not in self.naive_neighbors(enemy):
                     return msg % 'no wall behind him/her'
@@ -250,10 +319,13 @@ class Game:
                 ]
                 if not enemies:
                     return self.ERROR_FAR_AWAY
-                close = set(self.naive_neighbors())
                 enemies = [enemy for enemy in enemies if enemy in close]
                 if not enemies:
                     return msg % 'no wall\nbetween you and him/her'
+                enemies_neighbors = {
+                    enemy: frozenset(self.naive_neighbors(enemy))
+                    for enemy in enemies
+                }
                 behinds = [
                     (enemy, current_position + (enemy - current_position) * 2)
                     for enemy in enemies
@@ -262,14 +334,14 @@ class Game:
                     enemy
                     for enemy, behind in behinds
                     if not behind.in_grid()
-                    or behind not in self.naive_neighbors(enemy)
+                    or behind not in enemies_neighbors[enemy]
                 ]
                 if not enemies:
                     return msg % 'a wall behind him/her'
                 enemies = [
                     enemy
                     for enemy in enemies
-                    if destination in self.naive_neighbors(enemy)
+                    if destination in enemies_neighbors[enemy]
                 ]
                 if not enemies:
                     return msg % 'no wall\nbetween him/her and the destination'
@@ -286,11 +358,24 @@ class Board(qtw.QWidget):
         # Layout
         layout = qtw.QGridLayout()
         layout.setSpacing(0)
-        # Cell/Wall/Void widgets (in the layout)
-        self.posToWidget = {}
-        for widget, position in self._generateBoardWidgets():
-            layout.addWidget(widget, *position)
-            self.posToWidget[position] = widget
+        # Palettes shared by all Cell/Wall/Void widgets.
+        self.cellPalette = make_palette(qtg.QPalette.Button, CELL_COLOR)
+        self.wallPalette = make_palette(qtg.QPalette.Button, WALL_COLOR)
+        self.voidPalette = make_palette(qtg.QPalette.Window, VOID_COLOR)
+        # Palettes of Wall/Void widgets once filled by a player.
+        self.playerWallPalettes = [
+            make_palette(qtg.QPalette.Button, color) for color in PLAYER_COLORS
+        ]
+        self.playerVoidPalettes = [
+            make_palette(qtg.QPalette.Window, color) for color in PLAYER_COLORS
+        ]
+        # Cell/Wall/Void widgets (in the layout), 17 == 2 * 9 - 1.
+        self.grid: List[List[Optional[qtw.QWidget]]] = [
+            [None] * 17 for _ in range(17)
+        ]
+        for widget, row, col in self._generateBoardWidgets():
+            layout.addWidget(widget, row, col)
+            self.grid[row][col] = widget
         # Players widgets (in the layout)
         self.players = ()  # Not meant to be changed once it is fully defined.
         for color, (i, j) in zip(PLAYER_COLORS, PLAYER_STARTS):
@@ -300,7 +385,7 @@ class Board(qtw.QWidget):
         self.playerIndex = 0
         self.setLayout(layout)
         # Size
-        self.setSizePolicy(SizePolicyFixed)
+        self.setSizePolicy(_size_policy(qtw.QSizePolicy.Fixed))
         # Game validator
         self.game = Game()
 
@@ -309,14 +394,14 @@ class Board(qtw.QWidget):
         for row in range(0, 18, 2):
             for col in range(0, 18, 2):
                 if row and col:
-                    yield Void(self), Position(row - 1, col - 1)
+                    yield Void(self), row - 1, col - 1
                 if row:
                     cls = Wall if col < 16 else Void
-                    yield cls(self), Position(row - 1, col)
+                    yield cls(self), row - 1, col
                 if col:
                     cls = Wall if row < 16 else Void
-                    yield cls(self), Position(row, col - 1)
-                yield Cell(self), Position(row, col)
+                    yield cls(self), row, col - 1
+                yield Cell(self), row, col
 
     def sizeHint(self):
         return qtc.QSize(GRID_SIZE, GRID_SIZE)
@@ -331,7 +416,7 @@ class Board(qtw.QWidget):
         # ignoring the player that should be keeped over it. It seems to be
         # only momentarily (but still annoying) thanks to what's below.
         # Note that it happens only when it is the turn of the other player.
-        cell = self.posToWidget[position]
+        cell = self.grid[position.row][position.col]
         # layout.takeAt(layout.indexOf(cell))
         # layout.addWidget(cell, *position)
         player.setParent(cell)
@@ -339,11 +424,11 @@ class Board(qtw.QWidget):
         layout.addWidget(player, *position, alignment=qtc.Qt.AlignCenter)
 
     def addWall(self, position: Position, vertical: bool):
-        move = Position(vertical, not vertical)
-        positions = [position + move * n for n in range(3)]
-        for pos in positions:
-            assert isinstance(self.posToWidget[pos], (Wall, Void))
-            self.posToWidget[pos].filledBy(self.playerIndex)
+        row, col = position
+        for n in range(3):
+            widget = self.grid[row + n * vertical][col + n * (not vertical)]
+            assert isinstance(widget, (Wall, Void))
+            widget.filledBy(self.playerIndex)
         self.playerLabels[self.playerIndex].addWall()
 
     def nextTurn(self):
@@ -398,7 +483,7 @@ class TurnLabel(qtw.QLabel):
         super().__init__()
         self.nbPlayers = nbPlayers
         self.index = 0  # It will be between 1 and nbPlayers included.
-        self.setFont(TURN_FONT)
+        self.setFont(_font('turn'))
         self.nextTurn()
 
     def nextTurn(self):
@@ -423,7 +508,7 @@ class PlayerLabel(qtw.QLabel):
         self.nbWalls = 20 // nbPlayers
         self._text = 'Player %s: %%s wall%%s' % playerIndex
 
-        self.setFont(PLAYER_FONT)
+        self.setFont(_font('player'))
 
         color = PLAYER_COLORS[playerIndex - 1]
         palette = self.palette()
@@ -492,7 +577,7 @@ class MainWindow(qtw.QMainWindow):
             for index in range(1, self.nbPlayers + 1)
         )
         labels.append(qtw.QLabel('Error messages will be displayed here.'))
-        labels[-1].setFont(MESSAGE_FONT)
+        labels[-1].setFont(_font('message'))
 
         rightLayout = qtw.QVBoxLayout()
         for label in labels: